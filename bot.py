@@ -1,8 +1,14 @@
 import os
+import sys
 import time
 import math
+import random
+import atexit
 import logging
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timezone
 
@@ -10,13 +16,28 @@ import requests
 from zoneinfo import ZoneInfo
 
 from alpaca.trading.client import TradingClient
-from alpaca.trading.requests import MarketOrderRequest
-from alpaca.trading.enums import OrderSide, TimeInForce
+from alpaca.trading.requests import MarketOrderRequest, GetOrdersRequest
+from alpaca.trading.enums import OrderSide, TimeInForce, QueryOrderStatus
 
 from alpaca.data.live import StockDataStream
 from alpaca.data.enums import DataFeed
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+# -------------------- Logging --------------------
+# الكتابة على stdout تتم في thread منفصل حتى لا تبطئ إرسال الأوامر
+_log_queue = SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").strip().upper() or "INFO", format="%(message)s", handlers=[QueueHandler(_log_queue)])
+_log_listener = QueueListener(_log_queue, _log_stream)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# uvloop (اختياري): حلقة asyncio أسرع للـ WebSocket stream
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
 
 
 # -------------------- ENV helpers --------------------
@@ -37,23 +58,26 @@ def env_bool(name: str, default: str = "false") -> bool:
 
 
 # -------------------- Telegram --------------------
+# جلسة HTTP واحدة (keep-alive) بدل فتح اتصال TLS جديد مع كل رسالة
+_tg_session = requests.Session()
+
 def send_tg(text: str) -> None:
     token = os.getenv("TELEGRAM_BOT_TOKEN", "").strip()
     chat_id = os.getenv("TELEGRAM_CHAT_ID", "").strip()
     if not token or not chat_id:
         return
     try:
-        requests.post(
+        _tg_session.post(
             f"https://api.telegram.org/bot{token}/sendMessage",
             json={"chat_id": chat_id, "text": text, "disable_web_page_preview": True},
             timeout=10,
         )
     except Exception as e:
-        logging.warning(f"Telegram send failed: {e}")
+        logging.warning("Telegram send failed: %s", e)
 
 
 # -------------------- Config --------------------
-SYMBOLS = [s.strip().upper() for s in env("SYMBOLS", "TSLA,AAPL,NVDA,AMD,GOOGL,MSFT,META,AMZN,MU").split(",") if s.strip()]
+SYMBOLS = tuple(sys.intern(s.strip().upper()) for s in env("SYMBOLS", "TSLA,AAPL,NVDA,AMD,GOOGL,MSFT,META,AMZN,MU").split(",") if s.strip())
 NOTIONAL_PER_TRADE = env_float("OPEN_NOTIONAL_USD", "30000")
 
 WINDOW_SECONDS = env_int("OPEN_WINDOW_SECONDS", "45")          # تجمع بيانات كم ثانية بعد الافتتاح
@@ -86,35 +110,49 @@ state = {s: SymState(deque(maxlen=600), deque(maxlen=600), deque(maxlen=600)) fo
 
 # -------------------- Portfolio Helpers (التعديل الجديد) --------------------
 
-def get_open_positions_symbols(trading_client: TradingClient) -> list:
+def get_open_positions_symbols(trading_client: TradingClient) -> set:
     """
-    تجلب قائمة بكل الأسهم التي تملك فيها صفقات مفتوحة حالياً
+    تجلب مجموعة (set) بكل الأسهم التي تملك فيها صفقات مفتوحة حالياً
     """
     try:
         positions = trading_client.get_all_positions()
-        return [p.symbol.upper() for p in positions]
+        return {sys.intern(p.symbol.upper()) for p in positions}
+    except Exception as e:
+        logging.error("خطأ أثناء جلب الصفقات المفتوحة: %s", e)
+        return set()
+
+def get_open_orders_symbols(trading_client: TradingClient) -> set:
+    """
+    تجلب مجموعة الأسهم التي لديها أوامر معلقة (لم تُنفذ بعد) بطلب واحد
+    """
+    try:
+        orders = trading_client.get_orders(filter=GetOrdersRequest(status=QueryOrderStatus.OPEN, limit=500))
+        return {sys.intern(o.symbol.upper()) for o in orders}
     except Exception as e:
-        logging.error(f"خطأ أثناء جلب الصفقات المفتوحة: {e}")
-        return []
+        logging.error("خطأ أثناء جلب الأوامر المعلقة: %s", e)
+        return set()
+
+def get_open_symbols(trading_client: TradingClient) -> set:
+    """
+    لقطة واحدة: الصفقات المفتوحة + الأوامر المعلقة
+    """
+    return get_open_positions_symbols(trading_client) | get_open_orders_symbols(trading_client)
 
-def is_already_open(symbol: str, open_symbols: list) -> bool:
+def is_already_open(symbol: str, open_symbols: set) -> bool:
     """
-    تتحقق إذا كان السهم موجود في قائمة الصفقات المفتوحة
+    تتحقق إذا كان السهم موجود في مجموعة الصفقات المفتوحة (O(1))
     """
     return symbol.upper() in open_symbols
 
 
 # -------------------- Market Order helpers --------------------
-def place_market_entry(trading_client: TradingClient, symbol: str, direction: str, notional_usd: float, last_price: float):
+def place_market_entry(trading_client: TradingClient, symbol: str, direction: str, notional_usd: float, last_price: float,
+                       open_symbols: set | None = None):
     """
     تم إضافة فحص إضافي هنا لضمان عدم التكرار برمجياً
+    open_symbols: لقطة الصفقات المفتوحة من main (بدون طلب REST جديد لكل سهم)
     """
-    # فحص أخير قبل الإرسال للمنصة
-    current_positions = get_open_positions_symbols(trading_client)
-    if is_already_open(symbol, current_positions):
-        logging.warning(f"⚠️ إلغاء العملية: لديك صفقة مفتوحة بالفعل في {symbol}")
-        return None
-
+    # التحقق من المدخلات أولاً (بدون أي طلب للمنصة)
     if direction == "long":
         order = MarketOrderRequest(
             symbol=symbol,
@@ -122,29 +160,35 @@ def place_market_entry(trading_client: TradingClient, symbol: str, direction: st
             time_in_force=TimeInForce.DAY,
             notional=round(notional_usd, 2),
         )
-        return trading_client.submit_order(order)
+    else:
+        # short
+        if not ALLOW_SHORT:
+            raise RuntimeError("Short is disabled by ALLOW_SHORT=false")
 
-    # short
-    if not ALLOW_SHORT:
-        raise RuntimeError("Short is disabled by ALLOW_SHORT=false")
+        qty = math.floor(notional_usd / max(last_price, 0.01))
+        if qty <= 0:
+            raise ValueError(f"qty computed 0 for {symbol} (notional={notional_usd}, last={last_price})")
 
-    qty = math.floor(notional_usd / max(last_price, 0.01))
-    if qty <= 0:
-        raise ValueError(f"qty computed 0 for {symbol} (notional={notional_usd}, last={last_price})")
+        order = MarketOrderRequest(
+            symbol=symbol,
+            side=OrderSide.SELL,
+            time_in_force=TimeInForce.DAY,
+            qty=qty,
+        )
+
+    # فحص أخير قبل الإرسال للمنصة
+    current_positions = open_symbols if open_symbols is not None else get_open_symbols(trading_client)
+    if is_already_open(symbol, current_positions):
+        logging.warning("⚠️ إلغاء العملية: لديك صفقة مفتوحة بالفعل في %s", symbol)
+        return None
 
-    order = MarketOrderRequest(
-        symbol=symbol,
-        side=OrderSide.SELL,
-        time_in_force=TimeInForce.DAY,
-        qty=qty,
-    )
     return trading_client.submit_order(order)
 
 
 # -------------------- WebSocket handlers --------------------
 async def on_quote(q):
-    s = q.symbol.upper()
-    if s not in state:
+    st = state.get(q.symbol)
+    if st is None:
         return
     bid = float(q.bid_price or 0)
     ask = float(q.ask_price or 0)
@@ -153,21 +197,19 @@ async def on_quote(q):
     mid = (bid + ask) / 2.0
     spread_pct = (ask - bid) / mid if mid > 0 else 0.0
 
-    st = state[s]
     st.last_mid = mid
     st.last_spread = spread_pct
     st.mids.append(mid)
     st.spreads.append(spread_pct)
 
 async def on_trade(t):
-    s = t.symbol.upper()
-    if s not in state:
+    st = state.get(t.symbol)
+    if st is None:
         return
     price = float(t.price or 0)
     size = float(t.size or 0)
     if price <= 0:
         return
-    st = state[s]
     st.last_price = price
     st.trade_sizes.append(size)
 
@@ -254,23 +296,30 @@ def main():
     )
 
     ny = ZoneInfo("America/New_York")
+    clock_errors = 0
     while True:
         try:
             clock = trading.get_clock()
+            clock_errors = 0
             if clock.is_open:
                 break
-            time.sleep(5)
+            # ننام حتى موعد الافتتاح (بحد أقصى ساعة) بدل سؤال المنصة كل 5 ثواني
+            wait = (clock.next_open - clock.timestamp).total_seconds()
+            time.sleep(min(max(wait, 1.0), 3600.0))
         except Exception as e:
-            logging.warning(f"Clock error: {e}")
-            time.sleep(5)
+            # exponential backoff + full jitter حتى لا نضغط على المنصة وقت الأعطال
+            clock_errors += 1
+            delay = random.uniform(0, min(300.0, 5.0 * (1 << min(clock_errors - 1, 6))))
+            logging.warning("Clock error: %s (retry in %.1fs)", e, delay)
+            time.sleep(delay)
 
     reset_window_buffers()
-    start = time.time()
+    deadline = time.monotonic() + WINDOW_SECONDS
     logging.info("Market open detected. Collecting window...")
     send_tg(f"⏱️ Market OPEN detected. Collecting {WINDOW_SECONDS}s data to pick best 3...")
 
-    while time.time() - start < WINDOW_SECONDS:
-        time.sleep(0.2)
+    # نوم واحد حتى نهاية النافذة (monotonic لا يتأثر بتعديل ساعة النظام)
+    time.sleep(max(0.0, deadline - time.monotonic()))
 
     scored = []
     for s in SYMBOLS:
@@ -292,46 +341,67 @@ def main():
     filled = []
     rejected = []
 
-    # جلب الصفقات المفتوحة قبل البدء بالتنفيذ (لتجنب التكرار)
-    open_positions = get_open_positions_symbols(trading)
-
-    for r in scored:
-        if len(filled) >= 3:
-            break
-
-        symbol = r["symbol"]
-        direction = r["direction"]
-        last_price = float(r["last_price"] or r["last"])
-        spread_pct = r["spread"]
-
-        # حماية 1: فحص إذا السهم مفتوح فعلاً
-        if is_already_open(symbol, open_positions):
-            logging.info(f"Skipping {symbol}: Position already open in portfolio.")
-            continue
-
-        # حماية 2: فحص السبريد
-        if spread_pct > MAX_SPREAD_PCT:
-            continue
+    # جلب الصفقات المفتوحة والأوامر المعلقة مرة واحدة قبل البدء بالتنفيذ (لتجنب التكرار)
+    # ويتم تحديثها محلياً بعد كل أمر ناجح بدل إعادة طلبها من المنصة
+    open_positions = get_open_symbols(trading)
+
+    # الأوامر تُرسل بالتوازي (حتى 3 في نفس الوقت) بدل واحد تلو الآخر،
+    # وإذا رُفض أمر نكمل بالمرشح التالي حتى نصل إلى 3
+    candidates = iter(scored)
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        while len(filled) < 3:
+            batch = []
+            for r in candidates:
+                symbol = r["symbol"]
+
+                # حماية 1: فحص إذا السهم مفتوح فعلاً
+                if is_already_open(symbol, open_positions):
+                    logging.info("Skipping %s: Position already open in portfolio.", symbol)
+                    continue
+
+                # حماية 2: فحص السبريد
+                if r["spread"] > MAX_SPREAD_PCT:
+                    continue
+
+                batch.append(r)
+                if len(batch) >= 3 - len(filled):
+                    break
+
+            if not batch:
+                break
 
-        try:
-            order = place_market_entry(trading, symbol, direction, NOTIONAL_PER_TRADE, last_price)
-            
-            # التأكد أن الطلب تم إرساله ولم يتم رفضه من دالة الحماية
-            if order:
-                filled.append((symbol, direction, order.id))
-                send_tg(
-                    f"✅ ENTRY (Market)\n"
-                    f"{symbol} | {direction.upper()}\n"
-                    f"Last≈ {last_price:.2f}\n"
-                    f"Move: {r['move']*100:.3f}% | Spread: {spread_pct*100:.3f}%\n"
-                    f"Score: {r['score']:.1f}\n"
-                    f"⚠️ بيعك يدويًا (لن يتم الدخول مرتين لنفس السهم)"
-                )
-                logging.info(f"Submitted {symbol} {direction} order_id={order.id}")
-        except Exception as e:
-            rejected.append((symbol, str(e)))
-            logging.warning(f"Order rejected for {symbol}: {e}")
-            continue
+            futures = [
+                (r, pool.submit(
+                    place_market_entry, trading, r["symbol"], r["direction"], NOTIONAL_PER_TRADE,
+                    float(r["last_price"] or r["last"]), open_positions,
+                ))
+                for r in batch
+            ]
+
+            for r, fut in futures:
+                symbol = r["symbol"]
+                direction = r["direction"]
+                last_price = float(r["last_price"] or r["last"])
+                spread_pct = r["spread"]
+                try:
+                    order = fut.result()
+
+                    # التأكد أن الطلب تم إرساله ولم يتم رفضه من دالة الحماية
+                    if order:
+                        open_positions.add(symbol)
+                        filled.append((symbol, direction, order.id))
+                        send_tg(
+                            f"✅ ENTRY (Market)\n"
+                            f"{symbol} | {direction.upper()}\n"
+                            f"Last≈ {last_price:.2f}\n"
+                            f"Move: {r['move']*100:.3f}% | Spread: {spread_pct*100:.3f}%\n"
+                            f"Score: {r['score']:.1f}\n"
+                            f"⚠️ بيعك يدويًا (لن يتم الدخول مرتين لنفس السهم)"
+                        )
+                        logging.info("Submitted %s %s order_id=%s", symbol, direction, order.id)
+                except Exception as e:
+                    rejected.append((symbol, str(e)))
+                    logging.warning("Order rejected for %s: %s", symbol, e)
 
     if filled:
         send_tg(